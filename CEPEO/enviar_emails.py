@@ -10,21 +10,35 @@ personalizados usando um template HTML com imagens incorporadas.
 """
 
 import os
+import logging
 import sys
-import csv
-import smtplib
 import time
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.image import MIMEImage
+import asyncio
+import itertools
 from pathlib import Path
+import aiosmtplib
+from aiolimiter import AsyncLimiter
 from dotenv import load_dotenv
 
+# Módulos compartilhados entre as campanhas, na raiz do repositório
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from email_template import TemplateBuilder  # noqa: E402
+from email_campanha import (  # noqa: E402
+    INTERVALO_PROGRESSO,
+    MAX_CONEXOES_SIMULTANEAS,
+    MAX_MENSAGENS_POR_CONEXAO,
+    ConexoesSMTP,
+    LeitorContatos,
+    configurar_log,
+)
+
 # Carregar variáveis de ambiente
 load_dotenv()
 
+log = logging.getLogger(__name__)
+
 
-class EmailMarketingCEPEO:
+class EmailMarketingCEPEO(ConexoesSMTP):
     """Classe para gerenciar o envio de emails marketing da CEPEO"""
 
     def __init__(self):
@@ -36,6 +50,9 @@ class EmailMarketingCEPEO:
         self.from_name = os.getenv("FROM_NAME", "CEPEO")
         self.from_email = os.getenv("FROM_EMAIL", self.email_user)
         self.email_subject = os.getenv("EMAIL_SUBJECT", "CEPEO - Produtos em Destaque")
+        self.smtp_conexoes = int(os.getenv("SMTP_CONEXOES", 5))
+        self.smtp_taxa_maxima = int(os.getenv("SMTP_TAXA_MAXIMA", 50))
+        self.smtp_periodo_taxa = float(os.getenv("SMTP_PERIODO_TAXA", 10))
 
         # Validar credenciais
         if not self.email_user or not self.email_password:
@@ -54,6 +71,15 @@ class EmailMarketingCEPEO:
         # Verificar se os arquivos existem
         self._verificar_arquivos()
 
+        # Mensagem (HTML + imagens) montada e serializada uma única vez
+        self.template = self._carregar_template(
+            {
+                "logo_cepeo": self.logo_path,
+                "produto_1": self.produto1_path,
+                "produto_2": self.produto2_path,
+            }
+        )
+
     def _verificar_arquivos(self):
         """Verifica se todos os arquivos necessários existem"""
         arquivos_necessarios = {
@@ -74,187 +100,230 @@ class EmailMarketingCEPEO:
             print("\n".join(arquivos_faltando))
             sys.exit(1)
 
-    def ler_contatos(self):
-        """Lê os contatos do arquivo CSV (robusto contra colunas extras)"""
-        contatos = []
+    def _carregar_template(self, imagens):
+        """Lê o template HTML e as imagens e pré-serializa a mensagem"""
         try:
-            with open(self.csv_file, "r", encoding="utf-8") as file:
-                reader = csv.reader(file, delimiter=";")
-                header = next(reader, None)
-
-                # Tenta identificar índice das colunas Nome e Email
-                nome_idx = None
-                email_idx = None
-                for i, h in enumerate(header):
-                    col = h.strip().lower()
-                    if "nome" in col:
-                        nome_idx = i
-                    elif "email" in col:
-                        email_idx = i
-
-                if nome_idx is None or email_idx is None:
-                    raise ValueError(
-                        "Cabeçalhos 'Nome' e 'Email' não encontrados no CSV"
-                    )
-
-                for row in reader:
-                    if len(row) <= max(nome_idx, email_idx):
-                        continue  # pula linhas incompletas
-
-                    nome = row[nome_idx].strip()
-                    email = row[email_idx].strip()
-
-                    if nome and email and "@" in email:
-                        contatos.append({"nome": nome.title(), "email": email})
-
-            print(f"✅ {len(contatos)} contatos válidos carregados do CSV")
-            return contatos
+            return TemplateBuilder(
+                self.html_template,
+                imagens,
+                subject=self.email_subject,
+                sender=f"{self.from_name} <{self.from_email}>",
+            )
 
         except Exception as e:
-            print(f"❌ Erro ao ler o arquivo CSV: {e}")
+            print(f"❌ Erro ao carregar template do email: {e}")
             sys.exit(1)
 
-    def carregar_template_html(self, nome_destinatario):
-        """Carrega o template HTML e personaliza com o nome do destinatário"""
-        try:
-            with open(self.html_template, "r", encoding="utf-8") as file:
-                html_content = file.read()
-
-            # Substituir o placeholder {nome} pelo nome real
-            html_personalizado = html_content.replace("{nome}", nome_destinatario)
-            return html_personalizado
+    def iter_contatos(self):
+        """
+        Valida o cabeçalho do CSV e retorna um gerador com os contatos válidos,
+        lidos sob demanda (robusto contra colunas extras)
 
-        except Exception as e:
-            print(f"❌ Erro ao carregar template HTML: {e}")
-            sys.exit(1)
+        Raises:
+            OSError, ValueError: CSV ilegível ou sem as colunas Nome/Email
+        """
+        # O leitor guarda os contadores de ignorados para o relatório final
+        self.leitor = LeitorContatos(self.csv_file, com_nome=True)
+        return self.leitor.abrir()
 
     def criar_mensagem_email(self, destinatario_email, destinatario_nome):
-        """Cria a mensagem de email com HTML e imagens incorporadas"""
-        msg = MIMEMultipart("related")
-        msg["Subject"] = self.email_subject
-        msg["From"] = f"{self.from_name} <{self.from_email}>"
-        msg["To"] = destinatario_email
-
-        # Parte alternativa para suportar HTML
-        msg_alternative = MIMEMultipart("alternative")
-        msg.attach(msg_alternative)
-
-        # Carregar e anexar o HTML personalizado
-        html_content = self.carregar_template_html(destinatario_nome)
-        msg_html = MIMEText(html_content, "html", "utf-8")
-        msg_alternative.attach(msg_html)
-
-        # Anexar as imagens como inline (CID)
-        imagens = {
-            "logo_cepeo": self.logo_path,
-            "produto_1": self.produto1_path,
-            "produto_2": self.produto2_path,
-        }
-
-        for cid, caminho_imagem in imagens.items():
-            try:
-                with open(caminho_imagem, "rb") as img_file:
-                    img = MIMEImage(img_file.read())
-                    img.add_header("Content-ID", f"<{cid}>")
-                    img.add_header(
-                        "Content-Disposition", "inline", filename=caminho_imagem.name
-                    )
-                    msg.attach(img)
-            except Exception as e:
-                print(f"⚠️  Aviso: Erro ao anexar imagem {cid}: {e}")
+        """Gera a mensagem (bytes) personalizada para um destinatário"""
+        return self.template.render_bytes(destinatario_email, destinatario_nome)
 
-        return msg
-
-    def enviar_email(self, destinatario_email, destinatario_nome):
-        """Envia um email para um destinatário específico"""
+    async def enviar_email(self, smtp, destinatario_email, destinatario_nome):
+        """Envia um email para um destinatário usando uma conexão SMTP já aberta"""
         try:
             # Criar a mensagem
-            msg = self.criar_mensagem_email(destinatario_email, destinatario_nome)
-
-            # Verificar se é porta SSL (465) ou TLS (587)
-            if self.smtp_port == 465:
-                # Usar SMTP_SSL para porta 465
-                with smtplib.SMTP_SSL(self.smtp_server, self.smtp_port) as server:
-                    server.set_debuglevel(0)  # Desativa debug do SMTP
-                    server.login(self.email_user, self.email_password)
-                    server.send_message(msg)
-            else:
-                # Usar SMTP com STARTTLS para porta 587
-                with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-                    server.set_debuglevel(0)  # Desativa debug do SMTP
-                    server.starttls()
-                    server.login(self.email_user, self.email_password)
-                    server.send_message(msg)
+            dados = self.criar_mensagem_email(destinatario_email, destinatario_nome)
 
+            # Endereço internacional (não ASCII) exige SMTPUTF8 (RFC 6531);
+            # servidor sem suporte resulta em SMTPNotSupported
+            opcoes = () if destinatario_email.isascii() else ("SMTPUTF8",)
+            await self._enviar_com_retentativa(
+                smtp, [destinatario_email], dados, opcoes
+            )
             return True
 
+        except aiosmtplib.SMTPServerDisconnected:
+            # Conexão caiu: quem chamou reconecta e tenta novamente
+            raise
+
         except Exception as e:
-            print(f"\n❌ Erro ao enviar email para {destinatario_email}: {e}")
+            log.error("❌ Erro ao enviar email para %s: %s", destinatario_email, e)
+            # Erro fora do protocolo pode deixar um MAIL FROM aberto no servidor
+            await self._descartar_envelope(smtp)
             return False
 
-    def enviar_campanha(self, limite=None, delay=1):
+    async def _worker(self, fila, total, limitador):
+        """
+        Consome contatos da fila usando uma conexão SMTP própria
+
+        Returns:
+            tuple: (enviados, falhas) processados por este worker
+        """
+        enviados = 0
+        falhas = 0
+        smtp = None
+        mensagens_na_conexao = 0
+
+        try:
+            while True:
+                item = await fila.get()
+                if item is None:
+                    break
+
+                i, contato = item
+                nome = contato["nome"]
+                email = contato["email"]
+
+                # Respeita a taxa de envio do provedor (compartilhada entre workers)
+                await limitador.acquire()
+
+                inicio = time.time()
+                try:
+                    # Recicla a conexão ao atingir o limite de mensagens por sessão
+                    if smtp is None or mensagens_na_conexao >= MAX_MENSAGENS_POR_CONEXAO:
+                        smtp = await self._reconectar(smtp)
+                        mensagens_na_conexao = 0
+                    sucesso = await self.enviar_email(smtp, email, nome)
+                except (
+                    aiosmtplib.SMTPServerDisconnected,
+                    aiosmtplib.SMTPConnectError,
+                ) as e:
+                    log.warning("🔄 Conexão perdida (%s), reconectando...", e)
+                    try:
+                        smtp = await self._reconectar(None)
+                        mensagens_na_conexao = 0
+                        sucesso = await self.enviar_email(smtp, email, nome)
+                    except (aiosmtplib.SMTPException, OSError) as e:
+                        log.error("❌ Não foi possível reconectar: %s", e)
+                        smtp = None
+                        sucesso = False
+                except (aiosmtplib.SMTPException, OSError) as e:
+                    # Falha ao abrir/reciclar a conexão (timeout, autenticação,
+                    # TLS...): conta o envio como falha e tenta de novo no próximo
+                    log.error("❌ Não foi possível conectar: %s", e)
+                    smtp = None
+                    sucesso = False
+                mensagens_na_conexao += 1
+
+                if sucesso:
+                    tempo_decorrido = time.time() - inicio
+                    log.debug(
+                        "[%d/%d] ✅ %s (%s) em %.2fs", i, total, nome, email, tempo_decorrido
+                    )
+                    enviados += 1
+                else:
+                    log.warning("[%d/%d] ❌ Falha: %s (%s)", i, total, nome, email)
+                    falhas += 1
+
+                if i % INTERVALO_PROGRESSO == 0:
+                    log.info("📨 Progresso: %d/%d", i, total)
+
+        finally:
+            await self._fechar_conexao(smtp)
+
+        return enviados, falhas
+
+    async def enviar_campanha(
+        self, limite=None, conexoes=None, taxa_maxima=None, periodo_taxa=None
+    ):
         """
         Envia a campanha de email marketing para todos os contatos
 
         Args:
             limite (int): Número máximo de emails a enviar (None = todos)
-            delay (float): Tempo de espera entre envios em segundos
+            conexoes (int): Conexões SMTP simultâneas (None = SMTP_CONEXOES do .env)
+            taxa_maxima (int): Máximo de envios por período (None = SMTP_TAXA_MAXIMA)
+            periodo_taxa (float): Duração do período em segundos (None = SMTP_PERIODO_TAXA)
         """
         print("=" * 60)
         print("📧 SISTEMA DE EMAIL MARKETING - CEPEO")
         print("=" * 60)
         print()
 
-        # Ler contatos
-        contatos = self.ler_contatos()
+        # O cabeçalho é validado antes de abrir conexões; as linhas são lidas
+        # sob demanda enquanto os emails são enviados e o total é estimado
+        # pela contagem de linhas do CSV
+        try:
+            contatos = self.iter_contatos()
+            total = self.leitor.contar_linhas()
+        except (OSError, ValueError) as e:
+            print(f"❌ Erro ao ler o arquivo CSV: {e}")
+            return
 
-        if not contatos:
-            print("❌ Nenhum contato válido encontrado!")
+        if not total:
+            print("❌ Nenhum contato encontrado no CSV!")
             return
 
         # Aplicar limite se especificado
-        if limite and limite < len(contatos):
-            contatos = contatos[:limite]
+        if limite and limite < total:
+            contatos = itertools.islice(contatos, limite)
+            total = limite
             print(
                 f"⚠️  Modo de teste: enviando apenas para os primeiros {limite} contatos"
             )
 
+        # Número de workers limitado pelo provedor e pela quantidade de contatos
+        conexoes = min(conexoes or self.smtp_conexoes, MAX_CONEXOES_SIMULTANEAS, total)
+
+        # Leaky bucket: permite rajadas curtas mantendo a média abaixo do limite
+        limitador = AsyncLimiter(
+            taxa_maxima or self.smtp_taxa_maxima, periodo_taxa or self.smtp_periodo_taxa
+        )
+
         # Resumo da campanha
         print(f"\n📊 Resumo da campanha:")
-        print(f"   - Total de destinatários: {len(contatos)}")
+        print(f"   - Total de destinatários (estimado): {total}")
         print(f"   - Servidor SMTP: {self.smtp_server}")
+        print(f"   - Conexões simultâneas: {conexoes}")
+        print(
+            f"   - Taxa máxima: {limitador.max_rate:g} emails "
+            f"a cada {limitador.time_period:g}s"
+        )
         print(f"   - Remetente: {self.from_name} <{self.from_email}>")
         print(f"   - Assunto: {self.email_subject}")
         print()
 
         print("🚀 Iniciando envio de emails...\n")
 
-        # Estatísticas
-        enviados = 0
-        falhas = 0
-
         inicio_campanha = time.time()
 
-        # Enviar emails
-        for i, contato in enumerate(contatos, 1):
-            nome = contato["nome"]
-            email = contato["email"]
+        # Cada worker mantém sua própria conexão SMTP e consome da fila
+        fila = asyncio.Queue(maxsize=conexoes * 2)
 
-            print(f"[{i}/{len(contatos)}] Enviando para: {nome} ({email})...")
+        # Falha de leitura no meio do CSV encerra a fila normalmente: os workers
+        # terminam o que já receberam e o relatório é exibido
+        erro_leitura = None
 
-            inicio = time.time()
-            if self.enviar_email(email, nome):
-                tempo_decorrido = time.time() - inicio
-                print(f"    ✅ Sucesso! (tempo: {tempo_decorrido:.2f}s)")
-                enviados += 1
-            else:
-                print(f"    ❌ Falha!")
-                falhas += 1
+        async def alimentar_fila():
+            nonlocal erro_leitura
+            try:
+                for item in enumerate(contatos, 1):
+                    await fila.put(item)
+            except Exception as e:
+                erro_leitura = e
+            for _ in range(conexoes):
+                await fila.put(None)  # sinaliza fim para cada worker
+
+        resultados = await asyncio.gather(
+            alimentar_fila(),
+            *(self._worker(fila, total, limitador) for _ in range(conexoes)),
+        )
 
-            # Aguardar entre envios (evitar bloqueio por spam)
-            if i < len(contatos):
-                print(f"    ⏳ Aguardando {delay}s antes do próximo envio...")
-                time.sleep(delay)
+        # Estatísticas
+        enviados = sum(r[0] for r in resultados[1:])
+        falhas = sum(r[1] for r in resultados[1:])
+        processados = enviados + falhas
+
+        if erro_leitura is not None:
+            print(f"\n❌ Erro ao ler o arquivo CSV: {erro_leitura}")
+            print("⚠️  Envio interrompido: os contatos seguintes não foram processados")
+
+        if not processados:
+            if erro_leitura is None:
+                print("❌ Nenhum contato válido encontrado!")
+            return
 
         # Relatório final
         tempo_total = time.time() - inicio_campanha
@@ -263,25 +332,33 @@ class EmailMarketingCEPEO:
         print("=" * 60)
         print(f"✅ Emails enviados com sucesso: {enviados}")
         print(f"❌ Falhas no envio: {falhas}")
-        print(f"📈 Taxa de sucesso: {(enviados/len(contatos)*100):.1f}%")
+        # Linhas descartadas pela leitura (até onde o CSV foi lido)
+        if self.leitor.duplicados or self.leitor.invalidas:
+            print(
+                f"🔁 Contatos ignorados: {self.leitor.duplicados} duplicados, "
+                f"{self.leitor.invalidas} inválidos"
+            )
+        print(f"📈 Taxa de sucesso: {(enviados/processados*100):.1f}%")
         print(f"⏱️  Tempo total: {tempo_total:.2f}s ({tempo_total/60:.1f} minutos)")
         if enviados > 0:
-            print(f"⚡ Tempo médio por email: {tempo_total/len(contatos):.2f}s")
+            print(f"⚡ Tempo médio por email: {tempo_total/processados:.2f}s")
         print("=" * 60)
 
 
 def main():
     """Função principal"""
+    configurar_log()
+
     try:
         # Criar instância do sistema de email marketing
         email_system = EmailMarketingCEPEO()
 
         # Enviar campanha
         # Para teste, você pode limitar o número de emails:
-        # email_system.enviar_campanha(limite=5)  # Envia apenas para 5 contatos
+        # asyncio.run(email_system.enviar_campanha(limite=5))  # Envia apenas para 5 contatos
 
         # Para enviar para todos:
-        email_system.enviar_campanha()
+        asyncio.run(email_system.enviar_campanha())
 
     except KeyboardInterrupt:
         print("\n\n⚠️  Processo interrompido pelo usuário.")
@@ -10,21 +10,47 @@ personalizados usando um template HTML com imagens incorporadas.
 """
 
 import os
+import logging
 import sys
-import csv
-import smtplib
 import time
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.image import MIMEImage
+import asyncio
+import itertools
 from pathlib import Path
+import aiosmtplib
+from aiosmtplib.email import parse_address
+from aiolimiter import AsyncLimiter
 from dotenv import load_dotenv
 
+# Módulos compartilhados entre as campanhas, na raiz do repositório
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from email_template import TemplateBuilder  # noqa: E402
+from email_campanha import (  # noqa: E402
+    INTERVALO_PROGRESSO,
+    MAX_CONEXOES_SIMULTANEAS,
+    MAX_MENSAGENS_POR_CONEXAO,
+    ConexoesSMTP,
+    LeitorContatos,
+    configurar_log,
+    erro_transitorio,
+)
+
 # Carregar variáveis de ambiente
 load_dotenv()
 
+log = logging.getLogger(__name__)
+
+# Limite de destinatários (RCPT TO) por mensagem aceito pelo provedor (Gmail: 100)
+MAX_DESTINATARIOS_POR_ENVIO = 100
+
+# Cabeçalho To de envios em lote: os destinatários não ficam visíveis entre si
+DESTINATARIOS_OCULTOS = "undisclosed-recipients:;"
+
+# Rodadas de envio por lote: as seguintes reenviam só os destinatários
+# pendentes (recusa temporária ou conexão perdida no meio do lote)
+RODADAS_POR_LOTE = 2
 
-class EmailMarketingCEPEO:
+
+class EmailMarketingCEPEO(ConexoesSMTP):
     """Classe para gerenciar o envio de emails marketing da CEPEO"""
 
     def __init__(self):
@@ -36,6 +62,12 @@ class EmailMarketingCEPEO:
         self.from_name = os.getenv("FROM_NAME", "CEPEO")
         self.from_email = os.getenv("FROM_EMAIL", self.email_user)
         self.email_subject = os.getenv("EMAIL_SUBJECT", "CEPEO - Produtos em Destaque")
+        self.smtp_conexoes = int(os.getenv("SMTP_CONEXOES", 5))
+        self.smtp_destinatarios_por_envio = int(
+            os.getenv("SMTP_DESTINATARIOS_POR_ENVIO", 50)
+        )
+        self.smtp_taxa_maxima = int(os.getenv("SMTP_TAXA_MAXIMA", 50))
+        self.smtp_periodo_taxa = float(os.getenv("SMTP_PERIODO_TAXA", 10))
 
         # Validar credenciais
         if not self.email_user or not self.email_password:
@@ -53,6 +85,14 @@ class EmailMarketingCEPEO:
         # Verificar se os arquivos existem
         self._verificar_arquivos()
 
+        # Mensagem (HTML + imagens) montada e serializada uma única vez
+        self.template = self._carregar_template(
+            {
+                "logo": self.logo_path,
+                "natal": self.natal_path,
+            }
+        )
+
     def _verificar_arquivos(self):
         """Verifica se todos os arquivos necessários existem"""
         arquivos_necessarios = {
@@ -72,195 +112,333 @@ class EmailMarketingCEPEO:
             print("\n".join(arquivos_faltando))
             sys.exit(1)
 
-    def ler_contatos(self):
-        """Lê os contatos do arquivo CSV (apenas emails)"""
-        contatos = []
+    def _carregar_template(self, imagens):
+        """Lê o template HTML e as imagens e pré-serializa a mensagem"""
         try:
-            with open(self.csv_file, "r", encoding="utf-8") as file:
-                reader = csv.reader(file, delimiter=";")
-                header = next(reader, None)
-
-                # Tenta identificar índice da coluna Email
-                email_idx = None
-                for i, h in enumerate(header):
-                    col = h.strip().lower()
-                    if "email" in col:
-                        email_idx = i
-                        break
+            # Substituir o placeholder {nome} por nome genérico
+            return TemplateBuilder(
+                self.html_template,
+                imagens,
+                subject=self.email_subject,
+                sender=f"{self.from_name} <{self.from_email}>",
+                nome_fixo="Cliente",
+            )
 
-                if email_idx is None:
-                    raise ValueError("Cabeçalho 'Email' não encontrado no CSV")
+        except Exception as e:
+            print(f"❌ Erro ao carregar template do email: {e}")
+            sys.exit(1)
 
-                for row in reader:
-                    if len(row) <= email_idx:
-                        continue  # pula linhas incompletas
+    def iter_contatos(self):
+        """
+        Valida o cabeçalho do CSV e retorna um gerador com os contatos válidos,
+        lidos sob demanda (apenas emails)
 
-                    email = row[email_idx].strip()
+        Raises:
+            OSError, ValueError: CSV ilegível ou sem a coluna Email
+        """
+        # O leitor guarda os contadores de ignorados para o relatório final
+        self.leitor = LeitorContatos(self.csv_file, com_nome=False)
+        return self.leitor.abrir()
 
-                    if email and "@" in email:
-                        contatos.append({"email": email})
+    def criar_mensagem_email(self, para):
+        """Gera a mensagem (bytes) com o cabeçalho To informado"""
+        return self.template.render_bytes(para)
 
-            print(f"✅ {len(contatos)} contatos válidos carregados do CSV")
-            return contatos
+    async def _enviar_transacao(self, smtp, destinatarios, opcoes=()):
+        """
+        Envia a mensagem modelo a um grupo de destinatários numa transação SMTP
 
-        except Exception as e:
-            print(f"❌ Erro ao ler o arquivo CSV: {e}")
-            sys.exit(1)
+        Returns:
+            dict: Destinatários recusados pelo servidor (email -> erro)
+        """
+        # Lote de um só destinatário o exibe no To; lotes maiores ficam ocultos
+        if len(destinatarios) == 1:
+            para = destinatarios[0]
+        else:
+            para = DESTINATARIOS_OCULTOS
 
-    def carregar_template_html(self):
-        """Carrega o template HTML"""
+        dados = self.criar_mensagem_email(para)
         try:
-            with open(self.html_template, "r", encoding="utf-8") as file:
-                html_content = file.read()
+            return await self._enviar_com_retentativa(smtp, destinatarios, dados, opcoes)
+        except aiosmtplib.SMTPRecipientsRefused as e:
+            # Todos recusados: mesmo formato da recusa de parte do grupo
+            return {
+                erro.recipient: aiosmtplib.SMTPResponse(erro.code, erro.message)
+                for erro in e.recipients
+            }
+
+    async def enviar_email(self, smtp, destinatarios):
+        """
+        Envia a mensagem modelo para um lote de destinatários em uma única
+        transação SMTP (um MAIL FROM e um DATA para vários RCPT TO)
 
-            # Substituir o placeholder {nome} por nome genérico
-            html_personalizado = html_content.replace("{nome}", "Cliente")
-            return html_personalizado
+        Endereços internacionais (não ASCII) exigem SMTPUTF8 (RFC 6531) e vão
+        numa transação à parte, para que um servidor sem suporte não derrube
+        o restante do lote. Endereços malformados são descartados antes do
+        envio, já que o aiosmtplib recusaria o lote inteiro por causa deles.
 
-        except Exception as e:
-            print(f"❌ Erro ao carregar template HTML: {e}")
-            sys.exit(1)
+        Returns:
+            tuple: (aceitos, pendentes) - destinatários aceitos pelo servidor e
+            os que podem ser reenviados (recusa temporária ou conexão perdida)
+        """
+        validos = []
+        for email in destinatarios:
+            try:
+                parse_address(email)
+            except ValueError:
+                log.error("❌ Endereço inválido: %s", email)
+            else:
+                validos.append(email)
 
-    def criar_mensagem_email(self, destinatario_email):
-        """Cria a mensagem de email com HTML e imagens incorporadas"""
-        msg = MIMEMultipart("related")
-        msg["Subject"] = self.email_subject
-        msg["From"] = f"{self.from_name} <{self.from_email}>"
-        msg["To"] = destinatario_email
-
-        # Parte alternativa para suportar HTML
-        msg_alternative = MIMEMultipart("alternative")
-        msg.attach(msg_alternative)
-
-        # Carregar e anexar o HTML
-        html_content = self.carregar_template_html()
-        msg_html = MIMEText(html_content, "html", "utf-8")
-        msg_alternative.attach(msg_html)
-
-        # Anexar as imagens como inline (CID)
-        imagens = {
-            "logo": self.logo_path,
-            "natal": self.natal_path,
-        }
+        grupos = (
+            ([email for email in validos if email.isascii()], ()),
+            ([email for email in validos if not email.isascii()], ("SMTPUTF8",)),
+        )
+
+        aceitos = []
+        pendentes = []
+        for grupo, opcoes in grupos:
+            if not grupo:
+                continue
+
+            if not smtp.is_connected:
+                # Conexão caiu num grupo anterior: fica para a próxima conexão
+                pendentes.extend(grupo)
+                continue
 
-        for cid, caminho_imagem in imagens.items():
             try:
-                with open(caminho_imagem, "rb") as img_file:
-                    img_data = img_file.read()
-
-                    # Determinar o tipo MIME correto baseado na extensão
-                    if caminho_imagem.suffix.lower() == ".webp":
-                        # Para WebP, usar tipo genérico
-                        img = MIMEImage(img_data, _subtype="webp")
-                    elif caminho_imagem.suffix.lower() in [
-                        ".png",
-                        ".jpg",
-                        ".jpeg",
-                        ".gif",
-                    ]:
-                        img = MIMEImage(img_data)
-                    else:
-                        img = MIMEImage(img_data)
-
-                    img.add_header("Content-ID", f"<{cid}>")
-                    img.add_header(
-                        "Content-Disposition", "inline", filename=caminho_imagem.name
-                    )
-                    msg.attach(img)
+                recusados = await self._enviar_transacao(smtp, grupo, opcoes)
+
+            except aiosmtplib.SMTPServerDisconnected as e:
+                # Só este grupo e os seguintes são reenviados: os grupos
+                # anteriores já foram aceitos e não podem receber de novo
+                log.warning(
+                    "🔄 Conexão perdida (%s), %d destinatário(s) pendente(s)",
+                    e, len(grupo),
+                )
+                smtp.close()
+                pendentes.extend(grupo)
+                continue
+
             except Exception as e:
-                print(f"⚠️  Aviso: Erro ao anexar imagem {cid}: {e}")
+                log.error("❌ Erro ao enviar email para %s: %s", ", ".join(grupo), e)
+                # Erro fora do protocolo pode deixar um MAIL FROM aberto no servidor
+                await self._descartar_envelope(smtp)
+                continue
+
+            for email in grupo:
+                erro = recusados.get(email)
+                if erro is None:
+                    aceitos.append(email)
+                elif erro_transitorio(erro):
+                    pendentes.append(email)
+                else:
+                    log.error("❌ Destinatário recusado %s: %s", email, erro)
+
+        return aceitos, pendentes
+
+    async def _worker(self, fila, total, limitador):
+        """
+        Consome lotes de contatos da fila usando uma conexão SMTP própria
 
-        return msg
+        Returns:
+            tuple: (enviados, falhas) processados por este worker
+        """
+        enviados = 0
+        falhas = 0
+        smtp = None
+        mensagens_na_conexao = 0
 
-    def enviar_email(self, destinatario_email):
-        """Envia um email para um destinatário específico"""
         try:
-            # Criar a mensagem
-            msg = self.criar_mensagem_email(destinatario_email)
-
-            # Verificar se é porta SSL (465) ou TLS (587)
-            if self.smtp_port == 465:
-                # Usar SMTP_SSL para porta 465
-                with smtplib.SMTP_SSL(self.smtp_server, self.smtp_port) as server:
-                    server.set_debuglevel(0)  # Desativa debug do SMTP
-                    server.login(self.email_user, self.email_password)
-                    server.send_message(msg)
-            else:
-                # Usar SMTP com STARTTLS para porta 587
-                with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-                    server.set_debuglevel(0)  # Desativa debug do SMTP
-                    server.starttls()
-                    server.login(self.email_user, self.email_password)
-                    server.send_message(msg)
+            while True:
+                item = await fila.get()
+                if item is None:
+                    break
+
+                i, lote = item
+                destinatarios = [contato["email"] for contato in lote]
+
+                fim = i + len(destinatarios) - 1
+
+                inicio = time.time()
+                aceitos_lote = 0
+                pendentes = destinatarios
+                for _ in range(RODADAS_POR_LOTE):
+                    # Respeita a taxa de envio do provedor (compartilhada entre workers)
+                    await limitador.acquire(len(pendentes))
+
+                    try:
+                        # Reabre a conexão perdida ou recicla a que atingiu
+                        # o limite de mensagens por sessão
+                        if (
+                            smtp is None
+                            or not smtp.is_connected
+                            or mensagens_na_conexao >= MAX_MENSAGENS_POR_CONEXAO
+                        ):
+                            smtp = await self._reconectar(smtp)
+                            mensagens_na_conexao = 0
+                        aceitos, pendentes = await self.enviar_email(smtp, pendentes)
+                    except (aiosmtplib.SMTPException, OSError) as e:
+                        # Falha ao abrir/reciclar a conexão (timeout, autenticação,
+                        # TLS...): o lote continua pendente para a próxima rodada
+                        log.error("❌ Não foi possível conectar: %s", e)
+                        smtp = None
+                        aceitos = []
+                    mensagens_na_conexao += 1
+
+                    aceitos_lote += len(aceitos)
+                    if not pendentes:
+                        break
 
-            return True
+                for email in pendentes:
+                    log.error("❌ Não foi possível entregar para %s", email)
 
-        except Exception as e:
-            print(f"\n❌ Erro ao enviar email para {destinatario_email}: {e}")
-            return False
+                enviados += aceitos_lote
+                falhas += len(destinatarios) - aceitos_lote
 
-    def enviar_campanha(self, limite=None, delay=1):
+                if aceitos_lote == len(destinatarios):
+                    tempo_decorrido = time.time() - inicio
+                    log.debug("[%d-%d/%d] ✅ Sucesso em %.2fs", i, fim, total, tempo_decorrido)
+                elif aceitos_lote:
+                    log.warning(
+                        "[%d-%d/%d] ⚠️  Parcial: %d/%d aceitos",
+                        i, fim, total, aceitos_lote, len(destinatarios),
+                    )
+                else:
+                    log.warning("[%d-%d/%d] ❌ Falha!", i, fim, total)
+
+                # Registra o progresso sempre que o lote cruza um múltiplo do intervalo
+                if fim // INTERVALO_PROGRESSO > (i - 1) // INTERVALO_PROGRESSO:
+                    log.info("📨 Progresso: %d/%d", fim, total)
+
+        finally:
+            await self._fechar_conexao(smtp)
+
+        return enviados, falhas
+
+    async def enviar_campanha(
+        self,
+        limite=None,
+        conexoes=None,
+        taxa_maxima=None,
+        periodo_taxa=None,
+        destinatarios_por_envio=None,
+    ):
         """
         Envia a campanha de email marketing para todos os contatos
 
         Args:
             limite (int): Número máximo de emails a enviar (None = todos)
-            delay (float): Tempo de espera entre envios em segundos
+            conexoes (int): Conexões SMTP simultâneas (None = SMTP_CONEXOES do .env)
+            taxa_maxima (int): Máximo de envios por período (None = SMTP_TAXA_MAXIMA)
+            periodo_taxa (float): Duração do período em segundos (None = SMTP_PERIODO_TAXA)
+            destinatarios_por_envio (int): Destinatários (RCPT TO) por transação SMTP
+                (None = SMTP_DESTINATARIOS_POR_ENVIO do .env)
         """
         print("=" * 60)
         print("📧 SISTEMA DE EMAIL MARKETING - CEPEO")
         print("=" * 60)
         print()
 
-        # Ler contatos
-        contatos = self.ler_contatos()
+        # O cabeçalho é validado antes de abrir conexões; as linhas são lidas
+        # sob demanda enquanto os emails são enviados e o total é estimado
+        # pela contagem de linhas do CSV
+        try:
+            contatos = self.iter_contatos()
+            total = self.leitor.contar_linhas()
+        except (OSError, ValueError) as e:
+            print(f"❌ Erro ao ler o arquivo CSV: {e}")
+            return
 
-        if not contatos:
-            print("❌ Nenhum contato válido encontrado!")
+        if not total:
+            print("❌ Nenhum contato encontrado no CSV!")
             return
 
         # Aplicar limite se especificado
-        if limite and limite < len(contatos):
-            contatos = contatos[:limite]
+        if limite and limite < total:
+            contatos = itertools.islice(contatos, limite)
+            total = limite
             print(
                 f"⚠️  Modo de teste: enviando apenas para os primeiros {limite} contatos"
             )
 
+        # Leaky bucket: permite rajadas curtas mantendo a média abaixo do limite
+        limitador = AsyncLimiter(
+            taxa_maxima or self.smtp_taxa_maxima, periodo_taxa or self.smtp_periodo_taxa
+        )
+
+        # O corpo é idêntico para todos: agrupa destinatários em lotes, limitados
+        # pelo provedor e pela taxa máxima (cada lote consome a taxa de uma vez)
+        tamanho_lote = int(
+            min(
+                destinatarios_por_envio or self.smtp_destinatarios_por_envio,
+                MAX_DESTINATARIOS_POR_ENVIO,
+                limitador.max_rate,
+            )
+        )
+        total_lotes = -(-total // tamanho_lote)
+
+        # Número de workers limitado pelo provedor e pela quantidade de lotes
+        conexoes = min(
+            conexoes or self.smtp_conexoes, MAX_CONEXOES_SIMULTANEAS, total_lotes
+        )
+
         # Resumo da campanha
         print(f"\n📊 Resumo da campanha:")
-        print(f"   - Total de destinatários: {len(contatos)}")
+        print(f"   - Total de destinatários (estimado): {total}")
         print(f"   - Servidor SMTP: {self.smtp_server}")
+        print(f"   - Conexões simultâneas: {conexoes}")
+        print(f"   - Destinatários por envio: {tamanho_lote}")
+        print(
+            f"   - Taxa máxima: {limitador.max_rate:g} emails "
+            f"a cada {limitador.time_period:g}s"
+        )
         print(f"   - Remetente: {self.from_name} <{self.from_email}>")
         print(f"   - Assunto: {self.email_subject}")
         print()
 
         print("🚀 Iniciando envio de emails...\n")
 
-        # Estatísticas
-        enviados = 0
-        falhas = 0
-
         inicio_campanha = time.time()
 
-        # Enviar emails
-        for i, contato in enumerate(contatos, 1):
-            email = contato["email"]
+        # Cada worker mantém sua própria conexão SMTP e consome da fila
+        fila = asyncio.Queue(maxsize=conexoes * 2)
 
-            print(f"[{i}/{len(contatos)}] Enviando para: {email}...")
+        # Falha de leitura no meio do CSV encerra a fila normalmente: os workers
+        # terminam o que já receberam e o relatório é exibido
+        erro_leitura = None
 
-            inicio = time.time()
-            if self.enviar_email(email):
-                tempo_decorrido = time.time() - inicio
-                print(f"    ✅ Sucesso! (tempo: {tempo_decorrido:.2f}s)")
-                enviados += 1
-            else:
-                print(f"    ❌ Falha!")
-                falhas += 1
+        async def alimentar_fila():
+            nonlocal erro_leitura
+            try:
+                for i in itertools.count(1, tamanho_lote):
+                    lote = list(itertools.islice(contatos, tamanho_lote))
+                    if not lote:
+                        break
+                    await fila.put((i, lote))
+            except Exception as e:
+                erro_leitura = e
+            for _ in range(conexoes):
+                await fila.put(None)  # sinaliza fim para cada worker
 
-            # Aguardar entre envios (evitar bloqueio por spam)
-            if i < len(contatos):
-                print(f"    ⏳ Aguardando {delay}s antes do próximo envio...")
-                time.sleep(delay)
+        resultados = await asyncio.gather(
+            alimentar_fila(),
+            *(self._worker(fila, total, limitador) for _ in range(conexoes)),
+        )
+
+        # Estatísticas
+        enviados = sum(r[0] for r in resultados[1:])
+        falhas = sum(r[1] for r in resultados[1:])
+        processados = enviados + falhas
+
+        if erro_leitura is not None:
+            print(f"\n❌ Erro ao ler o arquivo CSV: {erro_leitura}")
+            print("⚠️  Envio interrompido: os contatos seguintes não foram processados")
+
+        if not processados:
+            if erro_leitura is None:
+                print("❌ Nenhum contato válido encontrado!")
+            return
 
         # Relatório final
         tempo_total = time.time() - inicio_campanha
@@ -269,25 +447,33 @@ class EmailMarketingCEPEO:
         print("=" * 60)
         print(f"✅ Emails enviados com sucesso: {enviados}")
         print(f"❌ Falhas no envio: {falhas}")
-        print(f"📈 Taxa de sucesso: {(enviados/len(contatos)*100):.1f}%")
+        # Linhas descartadas pela leitura (até onde o CSV foi lido)
+        if self.leitor.duplicados or self.leitor.invalidas:
+            print(
+                f"🔁 Contatos ignorados: {self.leitor.duplicados} duplicados, "
+                f"{self.leitor.invalidas} inválidos"
+            )
+        print(f"📈 Taxa de sucesso: {(enviados/processados*100):.1f}%")
         print(f"⏱️  Tempo total: {tempo_total:.2f}s ({tempo_total/60:.1f} minutos)")
         if enviados > 0:
-            print(f"⚡ Tempo médio por email: {tempo_total/len(contatos):.2f}s")
+            print(f"⚡ Tempo médio por email: {tempo_total/processados:.2f}s")
         print("=" * 60)
 
 
 def main():
     """Função principal"""
+    configurar_log()
+
     try:
         # Criar instância do sistema de email marketing
         email_system = EmailMarketingCEPEO()
 
         # Enviar campanha
         # Para teste, você pode limitar o número de emails:
-        # email_system.enviar_campanha(limite=5)  # Envia apenas para 5 contatos
+        # asyncio.run(email_system.enviar_campanha(limite=5))  # Envia apenas para 5 contatos
 
         # Para enviar para todos:
-        email_system.enviar_campanha()
+        asyncio.run(email_system.enviar_campanha())
 
     except KeyboardInterrupt:
         print("\n\n⚠️  Processo interrompido pelo usuário.")
@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Infraestrutura compartilhada entre as campanhas de Email Marketing
+
+Conexões SMTP (TLS, ajustes de socket e retentativas com backoff) e
+leitura dos contatos do CSV, vetorizada com pyarrow quando instalado e
+com o módulo csv da biblioteca padrão como alternativa.
+"""
+
+import csv
+import itertools
+import logging
+import os
+import re
+import socket
+import sys
+from pathlib import Path
+
+import aiosmtplib
+from tenacity import (
+    retry,
+    retry_if_exception,
+    stop_after_attempt,
+    wait_exponential,
+    wait_random,
+)
+
+try:
+    # Opcional: acelera a leitura de listas de contatos grandes
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    from pyarrow import csv as pacsv
+except ImportError:
+    pacsv = None
+
+log = logging.getLogger(__name__)
+
+# Máximo de emails enviados por conexão SMTP antes de reabri-la
+# (respeita o limite de mensagens por sessão dos provedores)
+MAX_MENSAGENS_POR_CONEXAO = 100
+
+# Limite de conexões SMTP simultâneas aceito pelo provedor (Gmail: 15)
+MAX_CONEXOES_SIMULTANEAS = 15
+
+# A cada quantos contatos o progresso da campanha é registrado (nível INFO)
+INTERVALO_PROGRESSO = 100
+
+# Retentativas com backoff exponencial para falhas SMTP temporárias
+TENTATIVAS_ENVIO = 3
+# Códigos 5xx que, apesar de permanentes pela RFC, costumam ser transitórios
+CODIGOS_5XX_TRANSITORIOS = {554}
+
+# Buffer de envio do socket SMTP: comporta a mensagem com imagens inline
+# inteira, que sai em poucas chamadas send() na fase DATA
+TAMANHO_BUFFER_ENVIO = 1 << 20
+
+# Padrões das colunas do CSV, compilados uma única vez
+_CABECALHO_NOME_RE = re.compile(r"nome", re.IGNORECASE)
+_CABECALHO_EMAIL_RE = re.compile(r"email", re.IGNORECASE)
+
+
+def configurar_log():
+    """Configura o logging pelo LOG_LEVEL do .env (INFO se ausente ou inválido)"""
+    # Detalhes por destinatário ficam em DEBUG; use LOG_LEVEL=DEBUG para vê-los
+    nivel_log = os.getenv("LOG_LEVEL", "INFO").upper()
+    if not isinstance(logging.getLevelName(nivel_log), int):
+        print(f"⚠️  LOG_LEVEL inválido ({nivel_log}), usando INFO")
+        nivel_log = "INFO"
+
+    logging.basicConfig(
+        level=nivel_log,
+        stream=sys.stderr,
+        format="%(message)s",
+    )
+
+
+def erro_transitorio(erro):
+    """Indica se uma falha SMTP é temporária (4xx ou 5xx conhecido) e vale retentar"""
+    if isinstance(erro, aiosmtplib.SMTPRecipientsRefused):
+        # Só retenta se a recusa for temporária para todos os destinatários
+        return bool(erro.recipients) and all(map(erro_transitorio, erro.recipients))
+    # SMTPResponse: recusa individual de um destinatário num lote aceito em parte
+    if isinstance(erro, (aiosmtplib.SMTPResponseException, aiosmtplib.SMTPResponse)):
+        return 400 <= erro.code < 500 or erro.code in CODIGOS_5XX_TRANSITORIOS
+    return False
+
+
+retentar_envio = retry(
+    retry=retry_if_exception(erro_transitorio),
+    wait=wait_exponential(multiplier=1, max=30) + wait_random(0, 1),
+    stop=stop_after_attempt(TENTATIVAS_ENVIO),
+    reraise=True,
+)
+
+
+def _ajustar_socket(smtp):
+    """Desativa o algoritmo de Nagle e amplia o buffer de envio da conexão"""
+    sock = smtp.transport.get_extra_info("socket") if smtp.transport else None
+    if sock is None:
+        return
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, TAMANHO_BUFFER_ENVIO)
+    except OSError as e:
+        # Ajuste é só otimização: segue com os padrões do sistema
+        log.debug("Não foi possível ajustar o socket SMTP: %s", e)
+
+
+def _indice_coluna(cabecalho, padrao):
+    """Retorna o índice da primeira coluna do cabeçalho que casa com o padrão"""
+    return next((i for i, h in enumerate(cabecalho) if padrao.search(h)), None)
+
+
+def _formatar_nome(nome):
+    """Capitaliza nomes todos em maiúsculas/minúsculas; os demais já vêm formatados"""
+    # Comparação em vez de isupper()/islower(): "ª" e "º" contam como
+    # minúsculas e fariam "Mª DO CARMO" passar sem capitalizar
+    if nome == nome.upper() or nome == nome.lower():
+        return nome.title()
+    return nome
+
+
+class ConexoesSMTP:
+    """
+    Conexões e envio SMTP compartilhados pelas campanhas
+
+    Classe base: quem herda define smtp_server, smtp_port, email_user,
+    email_password e from_email.
+    """
+
+    async def conectar_smtp(self):
+        """Abre uma conexão SMTP autenticada com o servidor configurado"""
+        # Verificar se é porta SSL (465) ou TLS (587)
+        if self.smtp_port == 465:
+            # Usar TLS implícito para porta 465
+            smtp = aiosmtplib.SMTP(
+                hostname=self.smtp_server, port=self.smtp_port, use_tls=True
+            )
+            await smtp.connect()
+            _ajustar_socket(smtp)
+        else:
+            # Usar SMTP com STARTTLS para porta 587
+            smtp = aiosmtplib.SMTP(
+                hostname=self.smtp_server, port=self.smtp_port, start_tls=False
+            )
+            await smtp.connect()
+            _ajustar_socket(smtp)
+
+        try:
+            if self.smtp_port != 465:
+                await smtp.starttls()
+            await smtp.login(self.email_user, self.email_password)
+        except (aiosmtplib.SMTPException, OSError):
+            # Não deixa a conexão aberta para trás se o TLS ou o login falharem
+            smtp.close()
+            raise
+
+        return smtp
+
+    @staticmethod
+    async def _fechar_conexao(smtp):
+        """Encerra a conexão SMTP, ignorando erros de uma conexão já caída"""
+        if smtp is None:
+            return
+        try:
+            await smtp.quit()
+        except (aiosmtplib.SMTPException, OSError):
+            smtp.close()
+
+    @staticmethod
+    async def _descartar_envelope(smtp):
+        """Desfaz uma transação interrompida (RSET); sem resposta, fecha a conexão"""
+        try:
+            await smtp.rset()
+        except (aiosmtplib.SMTPException, OSError):
+            smtp.close()
+
+    async def _reconectar(self, smtp):
+        """Encerra a conexão atual (se houver) e abre uma nova"""
+        await self._fechar_conexao(smtp)
+        return await self.conectar_smtp()
+
+    @retentar_envio
+    async def _enviar_com_retentativa(self, smtp, destinatarios, dados, opcoes=()):
+        """
+        Envia a mensagem, retentando com backoff em falhas SMTP temporárias
+
+        Returns:
+            dict: Destinatários recusados pelo servidor (email -> erro)
+        """
+        recusados, _ = await smtp.sendmail(
+            self.from_email, destinatarios, dados, mail_options=opcoes
+        )
+        return recusados
+
+
+class LeitorContatos:
+    """
+    Lê os contatos válidos de um CSV separado por ";", sob demanda e sem
+    emails repetidos (robusto contra colunas extras)
+
+    Os contadores abaixo são atualizados conforme a leitura avança e
+    alimentam o relatório final da campanha:
+        duplicados (int): Emails repetidos ignorados
+        invalidas (int): Linhas incompletas, sem "@" no email ou sem nome
+    """
+
+    def __init__(self, csv_file, com_nome=True):
+        """
+        Args:
+            csv_file (Path): CSV de contatos
+            com_nome (bool): Exige a coluna Nome (False = apenas emails)
+        """
+        self.csv_file = Path(csv_file)
+        self.com_nome = com_nome
+        self.duplicados = 0
+        self.invalidas = 0
+
+    def abrir(self):
+        """
+        Valida o cabeçalho do CSV e retorna um gerador com os contatos válidos
+        ({"nome", "email"} ou só {"email"}), lidos sob demanda
+
+        Raises:
+            OSError, ValueError: CSV ilegível ou sem as colunas esperadas
+        """
+        with open(self.csv_file, "r", encoding="utf-8-sig") as file:
+            header = next(csv.reader(file, delimiter=";"), None) or []
+        indices = self._indices_colunas(header)
+
+        self.duplicados = 0
+        self.invalidas = 0
+        return self._gerar_contatos(header, indices)
+
+    def contar_linhas(self):
+        """Conta rapidamente as linhas de dados do CSV (sem validar os contatos)"""
+        with open(self.csv_file, "rb") as file:
+            return max(sum(1 for _ in file) - 1, 0)  # desconta o cabeçalho
+
+    def _indices_colunas(self, header):
+        """Identifica os índices das colunas Nome (se exigida) e Email no cabeçalho"""
+        email_idx = _indice_coluna(header, _CABECALHO_EMAIL_RE)
+
+        if not self.com_nome:
+            if email_idx is None:
+                raise ValueError("Cabeçalho 'Email' não encontrado no CSV")
+            return None, email_idx
+
+        nome_idx = _indice_coluna(header, _CABECALHO_NOME_RE)
+        if nome_idx is None or email_idx is None:
+            raise ValueError("Cabeçalhos 'Nome' e 'Email' não encontrados no CSV")
+
+        return nome_idx, email_idx
+
+    def _gerar_contatos(self, header, indices):
+        """Gera os contatos do CSV sem emails repetidos"""
+        # Ignora emails repetidos (sem diferenciar maiúsculas de minúsculas)
+        vistos = set()
+        for contato in self._ler_contatos(header, indices):
+            chave = contato["email"].lower()
+            if chave in vistos:
+                self.duplicados += 1
+                continue
+            vistos.add(chave)
+            yield contato
+
+    def _ler_contatos(self, header, indices):
+        """
+        Lê os contatos com pyarrow, se instalado, ou com o módulo csv
+
+        O pyarrow falha em linhas com número de colunas diferente do cabeçalho
+        (colunas extras ou faltando); nesse caso a leitura segue pelo módulo
+        csv, que as aceita, a partir do ponto em que o pyarrow parou.
+        """
+        lidos = 0
+        if pacsv is not None:
+            try:
+                for contato in self._iter_contatos_arrow(header, indices):
+                    yield contato
+                    lidos += 1
+                return
+            except pa.ArrowInvalid as e:
+                log.debug("pyarrow não leu o CSV (%s); usando o módulo csv", e)
+                self.invalidas = 0  # o módulo csv reconta desde o início
+
+        # Os dois leitores geram os mesmos contatos na mesma ordem
+        yield from itertools.islice(self._iter_contatos_csv(indices), lidos, None)
+
+    def _iter_contatos_csv(self, indices):
+        """Lê os contatos linha a linha com o módulo csv da biblioteca padrão"""
+        nome_idx, email_idx = indices
+        ultimo_idx = email_idx if nome_idx is None else max(nome_idx, email_idx)
+
+        with open(self.csv_file, "r", encoding="utf-8") as file:
+            reader = csv.reader(file, delimiter=";")
+            next(reader, None)  # cabeçalho já validado em abrir
+
+            for row in reader:
+                if not row:
+                    continue  # linha em branco (o pyarrow também as ignora)
+
+                if len(row) <= ultimo_idx:
+                    self.invalidas += 1  # linha incompleta
+                    continue
+
+                # Email sem "@" (inclusive vazio) ou nome vazio invalida a linha
+                email = row[email_idx].strip()
+                if "@" in email:
+                    if nome_idx is None:
+                        yield {"email": email}
+                        continue
+
+                    nome = row[nome_idx].strip()
+                    if nome:
+                        yield {"nome": _formatar_nome(nome), "email": email}
+                        continue
+
+                self.invalidas += 1
+
+    def _iter_contatos_arrow(self, header, indices):
+        """
+        Lê e filtra os contatos em C++ com pyarrow, em blocos sob demanda
+
+        Raises:
+            pyarrow.ArrowInvalid: Linha irregular ou com UTF-8 inválido
+        """
+        nome_idx, email_idx = indices
+        coluna_email = header[email_idx]
+        colunas = [coluna_email]
+        if nome_idx is not None:
+            coluna_nome = header[nome_idx]
+            colunas.insert(0, coluna_nome)
+
+        # Sem invalid_row_handler: linhas irregulares levantam ArrowInvalid
+        with pacsv.open_csv(
+            self.csv_file,
+            parse_options=pacsv.ParseOptions(delimiter=";"),
+            convert_options=pacsv.ConvertOptions(
+                include_columns=colunas,
+                column_types={coluna: pa.string() for coluna in colunas},
+            ),
+        ) as leitor:
+            for bloco in leitor:
+                emails = pc.utf8_trim_whitespace(bloco.column(coluna_email))
+
+                # Email sem "@" (inclusive vazio) ou nome vazio invalida a linha
+                validos = pc.match_substring(emails, "@")
+
+                if nome_idx is None:
+                    emails = pc.filter(emails, validos).to_pylist()
+                    self.invalidas += bloco.num_rows - len(emails)
+                    for email in emails:
+                        yield {"email": email}
+                    continue
+
+                nomes = pc.utf8_trim_whitespace(bloco.column(coluna_nome))
+                validos = pc.and_(validos, pc.greater(pc.utf8_length(nomes), 0))
+                nomes = pc.filter(nomes, validos).to_pylist()
+                self.invalidas += bloco.num_rows - len(nomes)
+
+                for nome, email in zip(nomes, pc.filter(emails, validos).to_pylist()):
+                    yield {"nome": _formatar_nome(nome), "email": email}
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Template de Email Marketing compartilhado entre as campanhas
+
+Monta a mensagem (HTML + imagens inline) uma única vez e a serializa em
+bytes prontos para o SMTP. Por destinatário só é preciso trocar o
+cabeçalho To e, em campanhas personalizadas, o corpo HTML com o nome.
+"""
+
+import base64
+import mimetypes
+from email.generator import BytesGenerator
+from email.message import EmailMessage, MIMEPart
+from email.policy import SMTP
+from io import BytesIO
+from pathlib import Path
+
+# Marcadores gravados na mensagem serializada e substituídos a cada envio
+MARCADOR_DESTINATARIO = "destinatario@marcador.invalid"
+MARCADOR_CORPO = "@@CORPO_HTML@@"
+
+
+class TemplateBuilder:
+    """
+    Pré-monta e serializa a mensagem de uma campanha para envios em massa
+
+    render_bytes(to, nome=None) é gerada em __init__ (ver _compilar) e
+    retorna a mensagem completa, com quebras de linha CRLF, para o
+    cabeçalho To informado e, em templates personalizados, o nome. O To
+    sai em UTF-8: endereços internacionais exigem envio com SMTPUTF8.
+    """
+
+    def __init__(self, html_path, images, subject, sender, nome_fixo=None):
+        """
+        Lê o template e as imagens e serializa a mensagem modelo
+
+        Args:
+            html_path (Path): Template HTML, com o placeholder {nome} opcional
+            images (dict): Imagens inline no formato {cid: caminho}
+            subject (str): Assunto do email
+            sender (str): Cabeçalho From (ex.: "CEPEO <contato@cepeo.com.br>")
+            nome_fixo (str): Nome usado para todos os destinatários
+                (None = personalizar por destinatário em render_bytes)
+        """
+        html = Path(html_path).read_text(encoding="utf-8")
+        self._html_partes = html.split("{nome}")
+        if nome_fixo is not None:
+            self._html_partes = [nome_fixo.join(self._html_partes)]
+        self.personalizado = len(self._html_partes) > 1
+
+        # Imagem ilegível não impede a campanha: segue sem ela
+        self._partes_imagem = []
+        for cid, caminho in images.items():
+            try:
+                self._partes_imagem.append(self._criar_parte_imagem(cid, Path(caminho)))
+            except (OSError, ValueError) as e:
+                print(f"⚠️  Aviso: Erro ao anexar imagem {cid}: {e}")
+
+        msg = EmailMessage()
+        msg["Subject"] = subject
+        msg["From"] = sender
+        msg["To"] = MARCADOR_DESTINATARIO
+
+        # Corpo HTML; quando personalizado, um marcador ocupa o lugar do
+        # base64 e é trocado pelo HTML de cada destinatário em render_bytes
+        msg.set_content(self._html_partes[0], subtype="html", cte="base64")
+        if self.personalizado:
+            msg.set_payload(MARCADOR_CORPO)
+
+        # Converte em multipart/related e anexa as imagens já codificadas (CID)
+        msg.make_related()
+        for img in self._partes_imagem:
+            msg.attach(img)
+
+        self.render_bytes = self._compilar(self._serializar(msg))
+
+    @staticmethod
+    def _criar_parte_imagem(cid, caminho_imagem):
+        """Lê uma imagem do disco e cria a parte MIME inline correspondente"""
+        img_data = caminho_imagem.read_bytes()
+
+        # Determinar o tipo MIME correto baseado na extensão
+        tipo = mimetypes.guess_type(caminho_imagem.name)[0] or "application/octet-stream"
+
+        # Payload já em base64 (linhas de 76 colunas): monta os cabeçalhos
+        # manualmente para não passar pelo codificador do pacote email
+        img = MIMEPart()
+        img["Content-Type"] = tipo
+        img["Content-Transfer-Encoding"] = "base64"
+        img.add_header("Content-Disposition", "inline", filename=caminho_imagem.name)
+        img["Content-ID"] = f"<{cid}>"
+        img.set_payload(base64.encodebytes(img_data).decode("ascii"))
+        return img
+
+    @staticmethod
+    def _serializar(msg):
+        """Serializa a mensagem uma única vez, já com quebras de linha SMTP"""
+        buffer = BytesIO()
+        BytesGenerator(buffer, policy=SMTP).flatten(msg)
+        return buffer.getvalue()
+
+    def render_html(self, nome=None):
+        """Retorna o HTML do corpo, personalizado com o nome quando aplicável"""
+        return (nome or "").join(self._html_partes)
+
+    def _compilar(self, modelo):
+        """
+        Especializa a geração da mensagem para este template
+
+        Tudo que não depende do destinatário já está em bytes: a mensagem
+        serializada é cortada nos marcadores e os pedaços ficam presos como
+        argumentos padrão (variáveis locais) da função gerada, que só
+        concatena bytes, sem passar pelo pacote email.
+        """
+        antes_to, depois_to = modelo.split(MARCADOR_DESTINATARIO.encode("ascii"), 1)
+
+        if not self.personalizado:
+
+            def render_bytes(to, nome=None, _antes=antes_to, _depois=depois_to):
+                return b"".join((_antes, to.encode("utf-8"), _depois))
+
+            return render_bytes
+
+        meio, fim = depois_to.split(MARCADOR_CORPO.encode("ascii"), 1)
+
+        def render_bytes(
+            to,
+            nome=None,
+            _antes=antes_to,
+            _meio=meio,
+            _fim=fim,
+            _partes=self._html_partes,
+            _b64=base64.encodebytes,
+        ):
+            html = (nome or "").join(_partes).encode("utf-8")
+            corpo = _b64(html).rstrip(b"\n").replace(b"\n", b"\r\n")
+            return b"".join((_antes, to.encode("utf-8"), _meio, corpo, _fim))
+
+        return render_bytes